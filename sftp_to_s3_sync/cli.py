@@ -2,13 +2,64 @@ import sys
 import os
 import datetime
 import hashlib
+import io
+import base64
 import yaml
 import click
 import boto3
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
 import botocore
+from botocore.config import Config
 import paramiko
 import stat
 import logging
+import logging.handlers
+import threading
+import sqlite3
+import queue
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_PARALLEL_LISTINGS = 8
+DEFAULT_SFTP_CONNECTIONS = 4
+# Stays under OpenSSH's default MaxSessions (10 channels per connection).
+MAX_CHANNELS_PER_CONNECTION = 8
+HASH_CHUNK_SIZE = 1 << 20
+UPLOAD_BUFFER_SIZE = 1 << 22
+SYNC_QUEUE_SIZE = 1024
+DEFAULT_PARALLEL_MD5_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_HASH_CACHE_FILE = '~/.cache/sftp2s3/cache.sqlite'
+
+# (config section, key, environment variable overriding it)
+ENV_MAP = [
+    ('s3', 'bucket', 'S3_SFTP_SYNC__S3_BUCKET'),
+    ('s3', 'key_prefix', 'S3_SFTP_SYNC__S3_KEY_PREFIX'),
+    ('s3', 'aws_access_key_id', 'S3_SFTP_SYNC__AWS_ACCESS_KEY_ID'),
+    ('s3', 'aws_secret_access_key', 'S3_SFTP_SYNC__AWS_SECRET_ACCESS_KEY'),
+    ('s3', 'endpoint_url', 'S3_SFTP_SYNC__S3_ENDPOINT_URL'),
+    ('sftp', 'hostname', 'S3_SFTP_SYNC__SFTP_HOSTNAME'),
+    ('sftp', 'username', 'S3_SFTP_SYNC__SFTP_USERNAME'),
+    ('sftp', 'password', 'S3_SFTP_SYNC__SFTP_PASSWORD'),
+    ('sftp', 'port', 'S3_SFTP_SYNC__SFTP_PORT'),
+    ('incremental_sync', 'last_modified_s3_key', 'S3_SFTP_SYNC__SFTP_LAST_MODIFIED_S3_KEY'),
+]
+
+# Shared by a single transfer manager per run, so max_concurrency bounds the
+# part uploads across all files, and buffered parts are capped at
+# max_in_memory_upload_chunks * multipart_chunksize (160 MiB) in total.
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=16,
+    use_threads=True
+)
+
+
+def _utc_now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
 
 @click.command(name="sftp2s3")
 @click.option('--config-file',
@@ -19,25 +70,50 @@ import logging
                   ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']),
               help='Set logging level')
 def main(config_file: str, log_level: str) -> None:
-    logging.basicConfig(level=getattr(logging, log_level.upper(), logging.INFO), format="[%(asctime)s] [%(levelname)s] %(message)s")
+    log_handler, log_listener = configure_logging(log_level)
     global logger
     logger = logging.getLogger(__name__)
 
-    config = load_config(config_file)
-    s3_client = connect_s3(config['s3'])
-    sftp_client = connect_sftp(
-        hostname=config['sftp']['hostname'],
-        username=config['sftp']['username'],
-        password=config['sftp']['password'],
-        port=config['sftp'].get('port', 22)  # Pass the port from config, default to 22
-    )
-
     try:
-        sync_sftp_to_s3(sftp_client, s3_client, config)
-    except Exception as e:
-        raise click.ClickException(f"An error occurred: {str(e)}")
+        config = load_config(config_file)
+        s3_client = connect_s3(
+            config['s3'],
+            concurrency=config.get('concurrency', DEFAULT_CONCURRENCY)
+        )
+        sftp_client = SFTPConnectionPool(
+            hostname=config['sftp']['hostname'],
+            username=config['sftp']['username'],
+            password=config['sftp']['password'],
+            port=config['sftp'].get('port', 22),  # Pass the port from config, default to 22
+            size=sftp_pool_size(config)
+        )
+
+        try:
+            sync_sftp_to_s3(sftp_client, s3_client, config)
+        except Exception as e:
+            raise click.ClickException(f"An error occurred: {str(e)}")
+        finally:
+            sftp_client.close()
     finally:
-        sftp_client.close()
+        logging.getLogger().removeHandler(log_handler)
+        log_listener.stop()
+
+
+def configure_logging(log_level: str) -> tuple[logging.Handler, logging.handlers.QueueListener]:
+    # QueueHandler.prepare still merges each message with its args in the
+    # logging thread. The Formatter's asctime work and the write to stderr run
+    # on the listener thread, so workers don't contend on the stream's lock.
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("[%(asctime)s] [%(levelname)s] %(message)s"))
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, log_level.upper(), logging.INFO))
+    root.addHandler(queue_handler)
+    listener.start()
+    return queue_handler, listener
 
 
 def load_config(config_file: str) -> dict:
@@ -51,59 +127,16 @@ def load_config(config_file: str) -> dict:
         logger.error(f"Error loading configuration file: {str(e)}")
         raise click.ClickException("Unable to load configuration file. Please check the file path and permissions.")
 
-    def safe_get(obj, key, default=None):
-        return obj[key] if obj and key in obj else default
-
-    config.setdefault('s3', {})
-    config['s3']['bucket'] = os.getenv(
-        'S3_SFTP_SYNC__S3_BUCKET',
-        safe_get(config['s3'], 'bucket')
-    )
-    config['s3']['key_prefix'] = os.getenv(
-        'S3_SFTP_SYNC__S3_KEY_PREFIX',
-        safe_get(config['s3'], 'key_prefix')
-    )
-    config['s3']['aws_access_key_id'] = os.getenv(
-        'S3_SFTP_SYNC__AWS_ACCESS_KEY_ID',
-        safe_get(config['s3'], 'aws_access_key_id')
-    )
-    config['s3']['aws_secret_access_key'] = os.getenv(
-        'S3_SFTP_SYNC__AWS_SECRET_ACCESS_KEY',
-        safe_get(config['s3'], 'aws_secret_access_key')
-    )
-    config['s3']['endpoint_url'] = os.getenv(
-        'S3_SFTP_SYNC__S3_ENDPOINT_URL',
-        safe_get(config['s3'], 'endpoint_url')
-    )
-
-    config.setdefault('sftp', {})
-    config['sftp']['hostname'] = os.getenv(
-        'S3_SFTP_SYNC__SFTP_HOSTNAME',
-        safe_get(config['sftp'], 'hostname')
-    )
-    config['sftp']['username'] = os.getenv(
-        'S3_SFTP_SYNC__SFTP_USERNAME',
-        safe_get(config['sftp'], 'username')
-    )
-    config['sftp']['password'] = os.getenv(
-        'S3_SFTP_SYNC__SFTP_PASSWORD',
-        safe_get(config['sftp'], 'password')
-    )
-    config['sftp']['port'] = os.getenv(
-        'S3_SFTP_SYNC__SFTP_PORT',
-        safe_get(config['sftp'], 'port', 22)  # Default to 22 if not provided
-    )
-
-    config.setdefault('incremental_sync', {})
-    config['incremental_sync']['last_modified_s3_key'] = os.getenv(
-        'S3_SFTP_SYNC__SFTP_LAST_MODIFIED_S3_KEY',
-        safe_get(config['incremental_sync'], 'last_modified_s3_key')
-    )
+    for section, key, env_var in ENV_MAP:
+        values = config[section] = config.get(section) or {}
+        values[key] = os.environ.get(env_var, values.get(key))
+    if config['sftp']['port'] is None:
+        config['sftp']['port'] = 22  # Default to 22 if not provided
 
     return config
 
 
-def connect_s3(s3_config: dict) -> botocore.client.BaseClient:
+def connect_s3(s3_config: dict, concurrency: int = DEFAULT_CONCURRENCY) -> botocore.client.BaseClient:
     bucket = s3_config['bucket']
     aws_access_key_id = s3_config['aws_access_key_id']
     aws_secret_access_key = s3_config['aws_secret_access_key']
@@ -112,16 +145,26 @@ def connect_s3(s3_config: dict) -> botocore.client.BaseClient:
         logger.error("S3 configuration is incomplete. Please verify your configuration file or environment variables.")
         raise click.ClickException("Incomplete S3 configuration. Please verify your settings.")
 
-    return boto3.client(
+    # Size the HTTP pool to the sync workers plus the shared transfer
+    # manager's part uploads, so they don't evict (and re-handshake) each
+    # other's connections.
+    client_config = Config(
+        max_pool_connections=max(32, concurrency + TRANSFER_CONFIG.max_concurrency),
+        retries={'max_attempts': 10, 'mode': 'adaptive'},
+        tcp_keepalive=True
+    )
+    session = boto3.session.Session()
+    return session.client(
         's3',
         aws_access_key_id=aws_access_key_id,
         aws_secret_access_key=aws_secret_access_key,
-        endpoint_url=s3_config.get('endpoint_url')
+        endpoint_url=s3_config.get('endpoint_url'),
+        config=client_config
     )
 
 
 def sync_sftp_to_s3(
-    sftp_client: paramiko.SSHClient,
+    sftp_client: 'SFTPConnectionPool',
     s3_client: botocore.client.BaseClient,
     config: dict
 ) -> None:
@@ -134,40 +177,122 @@ def sync_sftp_to_s3(
 
     num_files_synced = 0
     num_bytes_synced = 0
+    lock = threading.Lock()
+
+    def _sync_one(
+        file_path: str,
+        attrs: paramiko.SFTPAttributes,
+        start_time: int | None = start_time,
+        key_prefix: str = key_prefix
+    ) -> None:
+        nonlocal last_modified, num_files_synced, num_bytes_synced
+        mtime = attrs.st_mtime
+        size = attrs.st_size
+
+        sftp = sessions.get()
+        full_key = key_prefix + file_path.lstrip('/')
+        with sftp.file(file_path) as file_obj:
+            upload, md5 = needs_upload(
+                s3_client,
+                bucket,
+                full_key,
+                file_obj,
+                mtime,
+                size,
+                start_time,
+                file_path=file_path,
+                hash_cache=hash_cache,
+                md5_pool=md5_pool,
+                remote_objects=remote_objects
+            )
+            if upload:
+                # Pipeline the SFTP reads ahead of the upload instead of
+                # paying a round-trip per 32 KiB request.
+                file_obj.prefetch(size)
+                upload_stream = io.BufferedReader(SFTPRawIO(file_obj, size), buffer_size=UPLOAD_BUFFER_SIZE)
+                upload_file_to_s3(
+                    s3_client,
+                    transfer_manager,
+                    bucket,
+                    full_key,
+                    upload_stream,
+                    mtime,
+                    size,
+                    md5
+                )
+                with lock:
+                    num_files_synced += 1
+                    num_bytes_synced += size
+            else:
+                logger.info("%s: no changes detected.", file_path)
 
-    with sftp_client.open_sftp() as sftp:
-        files = list_files_recursively(sftp)
-
-        for file_path in files:
-            stats = sftp.stat(file_path)
-            mtime = stats.st_mtime
-            size = stats.st_size
-
-            if should_sync_file(mtime, start_time):
-                with sftp.file(file_path) as file_obj:
-                    if needs_upload(
-                        s3_client,
-                        bucket,
-                        key_prefix,
-                        file_path,
-                        file_obj,
-                        mtime,
-                        start_time
-                    ):
-                        normalized_path = os.path.normpath(file_path).lstrip('/')
-                        upload_file_to_s3(s3_client, bucket, key_prefix + normalized_path, file_obj, mtime)
-                        num_files_synced += 1
-                        num_bytes_synced += size
-                    else:
-                        logger.info(f"{file_path}: no changes detected.")
-
+        with lock:
             if last_modified is None or mtime > last_modified:
                 last_modified = mtime
 
-    if marker_key and last_modified != start_time:
+    # Only files at exactly start_time are checked against S3, so a full run
+    # has nothing to look up.
+    remote_objects = None
+    if start_time is not None and config.get('prefetch_s3_listing', False):
+        remote_objects = list_s3_objects(s3_client, bucket, key_prefix)
+    hash_cache_file = config.get('hash_cache_file', DEFAULT_HASH_CACHE_FILE)
+    hash_cache = HashCache(hash_cache_file, config['sftp']['hostname']) if hash_cache_file else None
+    md5_threshold = config.get('parallel_md5_threshold', DEFAULT_PARALLEL_MD5_THRESHOLD)
+    md5_pool = MD5ProcessPool(config['sftp'], md5_threshold) if md5_threshold is not None else None
+    transfer_manager = create_transfer_manager(s3_client, TRANSFER_CONFIG)
+    listing_sessions = ThreadLocalSFTP(sftp_client)
+    sessions = ThreadLocalSFTP(sftp_client)
+    # Files are submitted as they are listed; the semaphore keeps the backlog
+    # in front of the workers bounded.
+    in_flight = threading.BoundedSemaphore(SYNC_QUEUE_SIZE)
+    errors = []
+    # Serializes submissions against the shutdown in _done, so nothing is
+    # submitted to the executor once it has been shut down.
+    submit_lock = threading.Lock()
+
+    def _done(future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            with submit_lock:
+                errors.append(future.exception())
+                # Drop the queued backlog on the first failure instead of
+                # syncing it only to raise afterwards.
+                executor.shutdown(wait=False, cancel_futures=True)
+        in_flight.release()
+
+    files = list_files_recursively(
+        listing_sessions,
+        max_workers=config.get('max_parallel_listings', DEFAULT_MAX_PARALLEL_LISTINGS),
+        start_time=start_time
+    )
+    try:
+        with ThreadPoolExecutor(max_workers=config.get('concurrency', DEFAULT_CONCURRENCY)) as executor:
+            for file_path, attrs in files:
+                in_flight.acquire()
+                with submit_lock:
+                    if errors:
+                        break
+                    future = executor.submit(_sync_one, file_path, attrs)
+                future.add_done_callback(_done)
+    finally:
+        files.close()
+        listing_sessions.close()
+        sessions.close()
+        if hash_cache:
+            hash_cache.close()
+        if md5_pool:
+            md5_pool.close()
+        transfer_manager.shutdown()
+
+    if errors:
+        raise errors[0]
+
+    # The marker is written once, and only after every upload succeeded: files
+    # finish out of order, so a partial run's last_modified can be ahead of a
+    # file that failed.
+    if marker_key and num_files_synced and last_modified != start_time:
         update_last_modified_marker(s3_client, bucket, marker_key, last_modified)
 
-    logger.info(f"Finished: {num_files_synced} files synced, {num_bytes_synced} bytes total.")
+    logger.info("Finished: %d files synced, %d bytes total.", num_files_synced, num_bytes_synced)
 
 
 def load_start_time_from_s3(
@@ -198,36 +323,102 @@ def should_sync_file(mtime: int, start_time: int | None) -> bool:
 def needs_upload(
     s3_client: botocore.client.BaseClient,
     bucket: str,
-    key_prefix: str,
-    file_path: str,
+    full_key: str,
     file_obj,
     mtime: int,
-    start_time: int | None
-) -> bool:
-    if mtime == start_time:
-        s3_hash = s3_md5(s3_client, bucket, key_prefix + file_path)
-        file_hash = file_md5(file_obj) if s3_hash else None
-        return s3_hash != file_hash
-    return True
+    size: int,
+    start_time: int | None,
+    *,
+    file_path: str | None = None,
+    hash_cache: 'HashCache | None' = None,
+    md5_pool: 'MD5ProcessPool | None' = None,
+    remote_objects: dict | None = None
+) -> tuple[bool, tuple[str, str] | None]:
+    """Returns whether to upload, plus the file's (hex, base64) MD5 if it had to be computed."""
+    if mtime != start_time:
+        return True, None
+
+    # A prefetched listing settles missing or resized objects, and objects
+    # whose ETag matches a cached MD5, without a HEAD; otherwise the HEAD is
+    # still needed for the user metadata LIST doesn't return.
+    if remote_objects is not None:
+        listed = remote_objects.get(full_key)
+        if listed is None or listed[1] != size:
+            return True, None
+        cached = hash_cache.get(file_path, size, mtime) if hash_cache else None
+        if cached is not None and cached[0] == listed[0]:
+            return False, cached
+
+    head = s3_head(s3_client, bucket, full_key)
+    if head is None:
+        return True, None
+    etag, s3_size, metadata = head
+    if s3_size != size:
+        return True, None
+
+    # Objects we uploaded carry the SFTP mtime, which is enough to decide
+    # without reading the file; otherwise compare MD5s, preferring the one we
+    # stored over the ETag.
+    s3_mtime = metadata.get('sftp_mtime')
+    if s3_mtime == str(mtime):
+        return False, None
+    s3_md5 = metadata.get('sftp_md5')
+    if s3_mtime is not None and s3_md5 is None:
+        return True, None
+
+    if s3_md5 is None and '-' in etag:
+        # Multipart ETags are the MD5 of the part MD5s, suffixed with "-N".
+        parts = int(etag.rsplit('-', 1)[1])
+        file_obj.prefetch(size)
+        return etag != file_md5_multipart(file_obj, multipart_part_size(size, parts)), None
+
+    digests = hash_cache.get(file_path, size, mtime) if hash_cache else None
+    if digests is None:
+        if md5_pool and size >= md5_pool.threshold:
+            digests = md5_pool.file_md5(file_path, size)
+        else:
+            file_obj.prefetch(size)
+            digests = file_md5(file_obj)
+        if hash_cache:
+            hash_cache.put(file_path, size, mtime, digests[0])
+    return (s3_md5 or etag) != digests[0], digests
 
 
 def upload_file_to_s3(
     s3_client: botocore.client.BaseClient,
+    transfer_manager,
     bucket: str,
     full_key: str,
     file_obj,
-    mtime: int
+    mtime: int,
+    size: int,
+    md5: tuple[str, str] | None = None
 ) -> None:
-    logger.info(f"Uploading {full_key}...")
-    s3_client.put_object(
-        Bucket=bucket,
-        Key=full_key,
-        Body=file_obj,
-        Metadata={
-            'sftp_mtime': str(mtime),
-            'sftp_sync_time': datetime.datetime.utcnow().isoformat()
-        }
-    )
+    logger.info("Uploading %s...", full_key)
+    metadata = {
+        'sftp_mtime': str(mtime),
+        'sftp_sync_time': _utc_now()
+    }
+    if md5 is not None:
+        md5_hex, md5_b64 = md5
+        metadata['sftp_md5'] = md5_hex
+        if size < TRANSFER_CONFIG.multipart_threshold:
+            # The transfer manager doesn't accept ContentMD5, so single-part
+            # uploads go through put_object to let S3 verify the digest we already have.
+            s3_client.put_object(
+                Bucket=bucket,
+                Key=full_key,
+                Body=file_obj,
+                ContentMD5=md5_b64,
+                Metadata=metadata
+            )
+            return
+    transfer_manager.upload(
+        file_obj,
+        bucket,
+        full_key,
+        extra_args={'Metadata': metadata}
+    ).result()
 
 
 def update_last_modified_marker(
@@ -264,36 +455,322 @@ def connect_sftp(hostname: str, username: str, password: str, port: int) -> para
         raise click.ClickException("Unable to connect to the SFTP server. Please verify your SFTP details.")
 
 
-def list_files_recursively(sftp, directory: str = ".") -> list:
-    logger.info("Listing all files in SFTP recursively...")
-    all_files = []
+def sftp_pool_size(config: dict) -> int:
+    # Listing and sync workers each hold a channel for the whole run, and the
+    # pool hands them out round-robin, so enough connections are opened to
+    # keep every one at or under MAX_CHANNELS_PER_CONNECTION.
+    channels = (
+        config.get('concurrency', DEFAULT_CONCURRENCY)
+        + config.get('max_parallel_listings', DEFAULT_MAX_PARALLEL_LISTINGS)
+    )
+    needed = -(-channels // MAX_CHANNELS_PER_CONNECTION)
+    return max(config.get('sftp_connections', DEFAULT_SFTP_CONNECTIONS), needed)
+
+
+class SFTPConnectionPool:
+    """Spreads SFTP channels over several SSH transports, since each transport serializes its channels."""
+
+    def __init__(self, hostname: str, username: str, password: str, port: int, size: int) -> None:
+        self._clients = queue.Queue()
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [
+                executor.submit(connect_sftp, hostname, username, password, port)
+                for _ in range(size)
+            ]
+        errors = []
+        for future in futures:
+            try:
+                self._clients.put(future.result())
+            except Exception as e:
+                errors.append(e)
+        if errors:
+            self.close()
+            raise errors[0]
+
+    def open_sftp(self) -> paramiko.SFTPClient:
+        # Rotate through the transports so channels are spread evenly.
+        client = self._clients.get()
+        self._clients.put(client)
+        return client.open_sftp()
+
+    def close(self) -> None:
+        while not self._clients.empty():
+            self._clients.get().close()
+
+
+class MD5ProcessPool:
+    """Hashes large files in worker processes, so reading and hashing them isn't bound to one core."""
+
+    def __init__(self, sftp_config: dict, threshold: int) -> None:
+        self.threshold = threshold
+        self._sftp_config = {
+            key: sftp_config[key] for key in ('hostname', 'username', 'password', 'port')
+        }
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def file_md5(self, file_path: str, size: int) -> tuple[str, str]:
+        with self._lock:
+            if self._executor is None:
+                # Forking a process that is running paramiko threads is unsafe.
+                self._executor = ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+            executor = self._executor
+        return executor.submit(_remote_file_md5, self._sftp_config, file_path, size).result()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
 
-    def _list(path):
-        for entry in sftp.listdir_attr(path):
-            full_path = os.path.join(path, entry.filename)
-            if stat.S_ISDIR(entry.st_mode):
-                _list(full_path)
-            else:
-                all_files.append(full_path)
 
-    _list(directory)
-    return all_files
+# Per-process SFTP session used by MD5ProcessPool workers.
+_worker_sftp = {}
 
 
-def s3_md5(s3_client: botocore.client.BaseClient, bucket: str, key: str) -> str | None:
+def _remote_file_md5(sftp_config: dict, file_path: str, size: int) -> tuple[str, str]:
+    if 'sftp' not in _worker_sftp:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(timeout=5, **sftp_config)
+        client.get_transport().set_keepalive(30)
+        _worker_sftp['client'] = client
+        _worker_sftp['sftp'] = client.open_sftp()
+    with _worker_sftp['sftp'].file(file_path) as file_obj:
+        file_obj.prefetch(size)
+        return file_md5(file_obj)
+
+
+class SFTPRawIO(io.RawIOBase):
+    """Adapts an SFTPFile to RawIOBase so it can sit under io.BufferedReader."""
+
+    def __init__(self, file_obj, size: int) -> None:
+        self._file_obj = file_obj
+        self._size = size
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        return self._file_obj.readinto(buffer)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        # SFTPFile.seek returns None, but io expects the new position. SEEK_END
+        # is answered from the listed size, since SFTPFile would FSTAT for it.
+        if whence == io.SEEK_END:
+            offset, whence = self._size + offset, io.SEEK_SET
+        self._file_obj.seek(offset, whence)
+        return self._file_obj.tell()
+
+    def tell(self) -> int:
+        return self._file_obj.tell()
+
+
+class ThreadLocalSFTP:
+    """Lazily opens one SFTP channel per thread, since SFTPClient is not thread-safe."""
+
+    def __init__(self, sftp_client: SFTPConnectionPool) -> None:
+        self._sftp_client = sftp_client
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    def get(self) -> paramiko.SFTPClient:
+        sftp = getattr(self._local, 'sftp', None)
+        if sftp is None:
+            sftp = self._sftp_client.open_sftp()
+            self._local.sftp = sftp
+            with self._lock:
+                self._sessions.append(sftp)
+        return sftp
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for sftp in sessions:
+            sftp.close()
+
+
+class HashCache:
+    """Remembers file MD5s by (path, size, mtime) so unchanged files aren't re-read across runs."""
+
+    def __init__(self, cache_file: str, namespace: str) -> None:
+        self._cache_file = os.path.expanduser(cache_file)
+        self._namespace = namespace
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Opened on first use, so runs that never hash don't touch the disk.
+        if self._conn is None:
+            cache_dir = os.path.dirname(self._cache_file)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            conn = sqlite3.connect(self._cache_file, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS files '
+                '(path TEXT PRIMARY KEY, size INT, mtime INT, md5 TEXT)'
+            )
+            self._conn = conn
+        return self._conn
+
+    def get(self, path: str, size: int, mtime: int) -> tuple[str, str] | None:
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT md5 FROM files WHERE path = ? AND size = ? AND mtime = ?',
+                (f"{self._namespace}:{path}", size, mtime)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], base64.b64encode(bytes.fromhex(row[0])).decode('ascii')
+
+    def put(self, path: str, size: int, mtime: int, md5: str) -> None:
+        with self._lock:
+            self._connect().execute(
+                'INSERT OR REPLACE INTO files (path, size, mtime, md5) VALUES (?, ?, ?, ?)',
+                (f"{self._namespace}:{path}", size, mtime, md5)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def list_files_recursively(
+    sessions: ThreadLocalSFTP,
+    directory: str = ".",
+    max_workers: int = DEFAULT_MAX_PARALLEL_LISTINGS,
+    start_time: int | None = None
+) -> Iterator[tuple[str, paramiko.SFTPAttributes]]:
+    if max_workers <= 0:
+        # With no workers the directory queue is never drained and the
+        # listing would wait forever.
+        raise ValueError("max_parallel_listings must be greater than 0")
+    logger.info("Listing all files in SFTP recursively...")
+    errors = []
+    stopped = threading.Event()
+    pending = queue.Queue()
+    found = queue.Queue(maxsize=SYNC_QUEUE_SIZE)
+    done = object()
+    pending.put(directory)
+
+    def _list() -> None:
+        while True:
+            path = pending.get()
+            if path is None:
+                pending.task_done()
+                return
+            try:
+                if not stopped.is_set():
+                    # SFTP paths are always POSIX; children of "." are kept
+                    # relative so they map straight onto S3 keys.
+                    parent = '' if path == '.' else path + '/'
+                    for entry in sessions.get().listdir_attr(path):
+                        if stopped.is_set():
+                            break
+                        full_path = parent + entry.filename
+                        if stat.S_ISDIR(entry.st_mode):
+                            pending.put(full_path)
+                        elif should_sync_file(entry.st_mtime, start_time):
+                            found.put((full_path, entry))
+            except Exception as e:
+                errors.append(e)
+                stopped.set()
+            finally:
+                pending.task_done()
+
+    def _finish() -> None:
+        # join() returns once every queued directory has been listed,
+        # including subdirectories pushed by the workers themselves.
+        pending.join()
+        for _ in workers:
+            pending.put(None)
+        for worker in workers:
+            worker.join()
+        found.put(done)
+
+    workers = [threading.Thread(target=_list, daemon=True) for _ in range(max_workers)]
+    for worker in workers:
+        worker.start()
+    threading.Thread(target=_finish, daemon=True).start()
+
+    item = None
+    try:
+        while (item := found.get()) is not done:
+            yield item
+    finally:
+        # If the consumer stops early, unblock the workers and let them wind down.
+        stopped.set()
+        while item is not done:
+            item = found.get()
+
+    if errors:
+        raise errors[0]
+
+
+def list_s3_objects(
+    s3_client: botocore.client.BaseClient,
+    bucket: str,
+    prefix: str
+) -> dict[str, tuple[str, int]]:
+    logger.info("Listing existing objects in s3://%s/%s...", bucket, prefix)
+    objects = {}
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            objects[obj['Key']] = (obj['ETag'].strip('"'), obj['Size'])
+    return objects
+
+
+def s3_head(
+    s3_client: botocore.client.BaseClient,
+    bucket: str,
+    key: str
+) -> tuple[str, int, dict] | None:
     try:
         response = s3_client.head_object(Bucket=bucket, Key=key)
-        return response['ETag'].strip('"').strip("'")
+        etag = response['ETag'].strip('"').strip("'")
+        return etag, response['ContentLength'], response.get('Metadata', {})
     except botocore.exceptions.ClientError as e:
         if e.response['Error']['Code'] != '404':
-            logger.error(f"Error fetching S3 object metadata: {e}")
+            logger.error("Error fetching S3 object metadata: %s", e)
             raise click.ClickException("Unable to fetch S3 object metadata. Please check your S3 configuration.")
         return None
 
 
-def file_md5(file_obj) -> str:
-    hash_md5 = hashlib.md5()
-    while chunk := file_obj.read(10240):
+def multipart_part_size(size: int, parts: int) -> int:
+    # The part size isn't stored on the object; try our own chunk size and
+    # boto3's default before assuming parts rounded up to a whole MiB.
+    for part_size in (TRANSFER_CONFIG.multipart_chunksize, 8 * 1024 * 1024):
+        if -(-size // part_size) == parts:
+            return part_size
+    mib = 1024 * 1024
+    return -(-size // (parts * mib)) * mib
+
+
+def file_md5_multipart(file_obj, part_size: int) -> str:
+    digests = []
+    while part := file_obj.read(part_size):
+        digests.append(hashlib.md5(part, usedforsecurity=False).digest())
+    file_obj.seek(0)
+    hash_md5 = hashlib.md5(b''.join(digests), usedforsecurity=False)
+    return f"{hash_md5.hexdigest()}-{len(digests)}"
+
+
+def file_md5(file_obj) -> tuple[str, str]:
+    # Large blocks keep the Python loop out of the way of hashlib. A local
+    # file could instead be hashed in one call over
+    # mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), but SFTP files have
+    # no file descriptor to map.
+    hash_md5 = hashlib.md5(usedforsecurity=False)
+    for chunk in iter(lambda: file_obj.read(HASH_CHUNK_SIZE), b''):
         hash_md5.update(chunk)
     file_obj.seek(0)
-    return hash_md5.hexdigest()
\ No newline at end of file
+    return hash_md5.hexdigest(), base64.b64encode(hash_md5.digest()).decode('ascii')
\ No newline at end of file
@@ -1,7 +1,22 @@
+import hashlib
+import io
+import logging
 import pytest
 from unittest import mock
+import click
 from click.testing import CliRunner
-from sftp_to_s3_sync.cli import main
+from sftp_to_s3_sync.cli import (
+    HashCache,
+    SFTPConnectionPool,
+    SFTPRawIO,
+    connect_s3,
+    file_md5_multipart,
+    list_files_recursively,
+    load_config,
+    main,
+    needs_upload,
+    sftp_pool_size,
+)
 
 def test_cli_help():
     runner = CliRunner()
@@ -44,3 +59,357 @@ def test_sync_success(mock_connect_s3, mock_connect_sftp):
         result = runner.invoke(main, ['--config-file', 'config_mock.yaml', '--log-level', 'INFO'])
 
     assert result.exit_code == 0
+
+@mock.patch('sftp_to_s3_sync.cli.create_transfer_manager')
+@mock.patch('sftp_to_s3_sync.cli.connect_sftp')
+@mock.patch('sftp_to_s3_sync.cli.connect_s3')
+def test_sync_uploads_files_in_parallel(mock_connect_s3, mock_connect_sftp, mock_create_transfer_manager):
+    s3_mock = mock.Mock()
+    mock_connect_s3.return_value = s3_mock
+
+    sftp_mock = mock.MagicMock()
+    open_sftp_mock = mock.MagicMock()
+    sftp_mock.open_sftp.return_value = open_sftp_mock
+    open_sftp_mock.__enter__.return_value = open_sftp_mock
+    open_sftp_mock.listdir_attr.return_value = [
+        mock.Mock(filename=f'file{i}.txt', st_mode=0o100644, st_mtime=100 + i, st_size=10)
+        for i in range(5)
+    ]
+    mock_connect_sftp.return_value = sftp_mock
+
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        with open('config_mock.yaml', 'w') as f:
+            f.write("s3:\n  bucket: bucket\nconcurrency: 4\n")
+        result = runner.invoke(main, ['--config-file', 'config_mock.yaml'])
+
+    assert result.exit_code == 0, result.output
+    transfer_manager = mock_create_transfer_manager.return_value
+    uploaded = sorted(c.args[2] for c in transfer_manager.upload.call_args_list)
+    assert uploaded == [f'file{i}.txt' for i in range(5)]
+
+def test_connect_s3_sizes_pool_to_concurrency():
+    s3_config = {
+        'bucket': 'bucket',
+        'aws_access_key_id': 'key',
+        'aws_secret_access_key': 'secret',
+    }
+    client = connect_s3(s3_config, concurrency=40)
+    assert client.meta.config.max_pool_connections == 56
+    assert client.meta.config.retries['mode'] == 'adaptive'
+
+def test_needs_upload_skips_read_when_size_and_mtime_match():
+    s3_mock = mock.Mock()
+    s3_mock.head_object.return_value = {
+        'ETag': '"abc"', 'ContentLength': 10, 'Metadata': {'sftp_mtime': '100'}
+    }
+    file_obj = mock.Mock()
+    assert needs_upload(s3_mock, 'bucket', 'key', file_obj, 100, 10, 100) == (False, None)
+    file_obj.read.assert_not_called()
+
+def test_needs_upload_falls_back_to_md5_for_legacy_objects():
+    s3_mock = mock.Mock()
+    s3_mock.head_object.return_value = {
+        'ETag': f'"{hashlib.md5(b"0123456789").hexdigest()}"', 'ContentLength': 10, 'Metadata': {}
+    }
+    file_obj = mock.Mock()
+    file_obj.read.side_effect = [b'0123456789', b'']
+    upload, md5 = needs_upload(s3_mock, 'bucket', 'key', file_obj, 100, 10, 100)
+    assert not upload
+    assert md5[0] == hashlib.md5(b'0123456789').hexdigest()
+    assert needs_upload(s3_mock, 'bucket', 'key', file_obj, 100, 11, 100) == (True, None)
+
+def test_needs_upload_prefers_stored_md5_over_etag():
+    s3_mock = mock.Mock()
+    s3_mock.head_object.return_value = {
+        'ETag': '"abc-2"',
+        'ContentLength': 10,
+        'Metadata': {'sftp_mtime': '99', 'sftp_md5': hashlib.md5(b'0123456789').hexdigest()}
+    }
+    file_obj = mock.Mock()
+    file_obj.read.side_effect = [b'0123456789', b'']
+    upload, _ = needs_upload(s3_mock, 'bucket', 'key', file_obj, 100, 10, 100)
+    assert not upload
+
+@mock.patch('sftp_to_s3_sync.cli.logger', create=True)
+def test_list_files_recursively_walks_subdirectories(mock_logger):
+    tree = {
+        '.': [('a.txt', 0o100644), ('sub', 0o040755)],
+        'sub': [('b.txt', 0o100644), ('deeper', 0o040755)],
+        'sub/deeper': [('c.txt', 0o100644)],
+    }
+    sftp_mock = mock.Mock()
+    sftp_mock.listdir_attr.side_effect = lambda path: [
+        mock.Mock(filename=name, st_mode=mode) for name, mode in tree[path]
+    ]
+    sessions = mock.Mock()
+    sessions.get.return_value = sftp_mock
+
+    files = list_files_recursively(sessions, max_workers=3)
+    assert sorted(path for path, _ in files) == ['a.txt', 'sub/b.txt', 'sub/deeper/c.txt']
+
+@mock.patch('sftp_to_s3_sync.cli.logger', create=True)
+def test_load_config_env_overrides(mock_logger, monkeypatch, tmp_path):
+    config_file = tmp_path / 'config.yaml'
+    config_file.write_text("s3:\n  bucket: from-file\n  key_prefix: prefix/\nsftp:\n")
+    monkeypatch.setenv('S3_SFTP_SYNC__S3_BUCKET', 'from-env')
+
+    config = load_config(str(config_file))
+    assert config['s3']['bucket'] == 'from-env'
+    assert config['s3']['key_prefix'] == 'prefix/'
+    assert config['sftp']['port'] == 22
+    assert config['incremental_sync']['last_modified_s3_key'] is None
+
+def test_file_md5_multipart_matches_s3_etag_format():
+    data = b'a' * 10 + b'b' * 10 + b'c' * 5
+    expected = hashlib.md5(
+        hashlib.md5(b'a' * 10).digest()
+        + hashlib.md5(b'b' * 10).digest()
+        + hashlib.md5(b'c' * 5).digest()
+    ).hexdigest() + '-3'
+    assert file_md5_multipart(io.BytesIO(data), 10) == expected
+
+@mock.patch('sftp_to_s3_sync.cli.connect_sftp')
+def test_sftp_connection_pool_rotates_transports(mock_connect_sftp):
+    clients = [mock.Mock(name=f'client{i}') for i in range(3)]
+    mock_connect_sftp.side_effect = clients
+
+    pool = SFTPConnectionPool('host', 'user', 'pass', 22, size=3)
+    for _ in range(6):
+        pool.open_sftp()
+    assert [c.open_sftp.call_count for c in clients] == [2, 2, 2]
+
+    pool.close()
+    for client in clients:
+        client.close.assert_called_once()
+
+def test_sftp_pool_size_keeps_channels_under_max_sessions():
+    assert sftp_pool_size({}) == 4
+    assert sftp_pool_size({'concurrency': 32, 'max_parallel_listings': 16}) == 6
+    assert sftp_pool_size({'concurrency': 4, 'max_parallel_listings': 4, 'sftp_connections': 2}) == 2
+
+def test_needs_upload_reuses_cached_md5(tmp_path):
+    s3_mock = mock.Mock()
+    s3_mock.head_object.return_value = {
+        'ETag': f'"{hashlib.md5(b"0123456789").hexdigest()}"', 'ContentLength': 10, 'Metadata': {}
+    }
+    hash_cache = HashCache(str(tmp_path / 'cache.sqlite'), 'host')
+
+    file_obj = mock.Mock()
+    file_obj.read.side_effect = [b'0123456789', b'']
+    assert not needs_upload(
+        s3_mock, 'bucket', 'key', file_obj, 100, 10, 100, file_path='./a.txt', hash_cache=hash_cache
+    )[0]
+
+    file_obj = mock.Mock()
+    upload, md5 = needs_upload(
+        s3_mock, 'bucket', 'key', file_obj, 100, 10, 100, file_path='./a.txt', hash_cache=hash_cache
+    )
+    assert not upload
+    assert md5[0] == hashlib.md5(b'0123456789').hexdigest()
+    file_obj.read.assert_not_called()
+    hash_cache.close()
+
+@mock.patch('sftp_to_s3_sync.cli.logger', create=True)
+def test_list_files_recursively_raises_listing_errors(mock_logger):
+    sessions = mock.Mock()
+    sessions.get.return_value.listdir_attr.side_effect = OSError('permission denied')
+    with pytest.raises(OSError):
+        list(list_files_recursively(sessions, max_workers=2))
+
+@mock.patch('sftp_to_s3_sync.cli.create_transfer_manager')
+@mock.patch('sftp_to_s3_sync.cli.connect_sftp')
+@mock.patch('sftp_to_s3_sync.cli.connect_s3')
+def test_sync_surfaces_upload_errors(mock_connect_s3, mock_connect_sftp, mock_create_transfer_manager):
+    s3_mock = mock.Mock()
+    transfer_manager = mock_create_transfer_manager.return_value
+    transfer_manager.upload.return_value.result.side_effect = RuntimeError('upload failed')
+    mock_connect_s3.return_value = s3_mock
+
+    sftp_mock = mock.MagicMock()
+    sftp_mock.open_sftp.return_value.listdir_attr.return_value = [
+        mock.Mock(filename='file.txt', st_mode=0o100644, st_mtime=100, st_size=10)
+    ]
+    mock_connect_sftp.return_value = sftp_mock
+
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        with open('config_mock.yaml', 'w') as f:
+            f.write("s3:\n  bucket: bucket\n")
+        result = runner.invoke(main, ['--config-file', 'config_mock.yaml'])
+
+    assert result.exit_code != 0
+    assert "upload failed" in result.output
+
+@mock.patch('sftp_to_s3_sync.cli.create_transfer_manager')
+@mock.patch('sftp_to_s3_sync.cli.connect_sftp')
+@mock.patch('sftp_to_s3_sync.cli.connect_s3')
+def test_sync_cancels_backlog_after_first_error(mock_connect_s3, mock_connect_sftp, mock_create_transfer_manager):
+    transfer_manager = mock_create_transfer_manager.return_value
+    transfer_manager.upload.return_value.result.side_effect = RuntimeError('upload failed')
+    mock_connect_s3.return_value = mock.Mock()
+
+    sftp_mock = mock.MagicMock()
+    sftp_mock.open_sftp.return_value.listdir_attr.return_value = [
+        mock.Mock(filename=f'file{i}.txt', st_mode=0o100644, st_mtime=100, st_size=10)
+        for i in range(20)
+    ]
+    mock_connect_sftp.return_value = sftp_mock
+
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        with open('config_mock.yaml', 'w') as f:
+            f.write("s3:\n  bucket: bucket\nconcurrency: 1\n")
+        result = runner.invoke(main, ['--config-file', 'config_mock.yaml'])
+
+    assert result.exit_code != 0
+    assert transfer_manager.upload.call_count == 1
+
+@mock.patch('sftp_to_s3_sync.cli.logger', create=True)
+def test_list_files_recursively_skips_files_older_than_start_time(mock_logger):
+    sftp_mock = mock.Mock()
+    sftp_mock.listdir_attr.return_value = [
+        mock.Mock(filename='old.txt', st_mode=0o100644, st_mtime=99),
+        mock.Mock(filename='same.txt', st_mode=0o100644, st_mtime=100),
+        mock.Mock(filename='new.txt', st_mode=0o100644, st_mtime=101),
+    ]
+    sessions = mock.Mock()
+    sessions.get.return_value = sftp_mock
+
+    files = list_files_recursively(sessions, max_workers=1, start_time=100)
+    assert sorted(path for path, _ in files) == ['new.txt', 'same.txt']
+
+@mock.patch('sftp_to_s3_sync.cli.create_transfer_manager')
+@mock.patch('sftp_to_s3_sync.cli.connect_sftp')
+@mock.patch('sftp_to_s3_sync.cli.connect_s3')
+def test_sync_writes_marker_once_after_uploads(mock_connect_s3, mock_connect_sftp, mock_create_transfer_manager):
+    s3_mock = mock.Mock()
+    s3_mock.get_object.return_value = {'Body': mock.Mock(read=mock.Mock(return_value=b'100'))}
+    mock_connect_s3.return_value = s3_mock
+
+    sftp_mock = mock.MagicMock()
+    sftp_mock.open_sftp.return_value.listdir_attr.return_value = [
+        mock.Mock(filename='old.txt', st_mode=0o100644, st_mtime=50, st_size=10),
+        mock.Mock(filename='new.txt', st_mode=0o100644, st_mtime=150, st_size=10),
+    ]
+    mock_connect_sftp.return_value = sftp_mock
+
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        with open('config_mock.yaml', 'w') as f:
+            f.write("s3:\n  bucket: bucket\nincremental_sync:\n  last_modified_s3_key: marker\n")
+        result = runner.invoke(main, ['--config-file', 'config_mock.yaml'])
+
+    assert result.exit_code == 0, result.output
+    assert mock_create_transfer_manager.return_value.upload.call_count == 1
+    s3_mock.put_object.assert_called_once_with(Bucket='bucket', Key='marker', Body=b'150')
+
+def test_needs_upload_hashes_large_files_in_md5_pool():
+    s3_mock = mock.Mock()
+    s3_mock.head_object.return_value = {'ETag': '"abc"', 'ContentLength': 100, 'Metadata': {}}
+    md5_pool = mock.Mock(threshold=50)
+    md5_pool.file_md5.return_value = ('abc', 'q80=')
+    file_obj = mock.Mock()
+
+    upload, md5 = needs_upload(
+        s3_mock, 'bucket', 'key', file_obj, 100, 100, 100, file_path='./big.bin', md5_pool=md5_pool
+    )
+    assert not upload
+    assert md5 == ('abc', 'q80=')
+    md5_pool.file_md5.assert_called_once_with('./big.bin', 100)
+    file_obj.read.assert_not_called()
+
+def test_needs_upload_uses_prefetched_listing_instead_of_head():
+    s3_mock = mock.Mock()
+    remote_objects = {'present': ('abc', 10)}
+    file_obj = mock.Mock()
+
+    assert needs_upload(s3_mock, 'bucket', 'missing', file_obj, 100, 10, 100, remote_objects=remote_objects)[0]
+    assert needs_upload(s3_mock, 'bucket', 'present', file_obj, 100, 11, 100, remote_objects=remote_objects)[0]
+    s3_mock.head_object.assert_not_called()
+
+def test_sftp_raw_io_supports_buffered_seek_and_read():
+
+    class FakeSFTPFile:
+        def __init__(self, data):
+            self._data = io.BytesIO(data)
+
+        def readinto(self, buffer):
+            return self._data.readinto(buffer)
+
+        def seek(self, offset, whence=io.SEEK_SET):
+            assert whence != io.SEEK_END, "SEEK_END costs an FSTAT round trip"
+            self._data.seek(offset, whence)
+
+        def tell(self):
+            return self._data.tell()
+
+    reader = io.BufferedReader(SFTPRawIO(FakeSFTPFile(b'0123456789'), 10), buffer_size=4)
+    assert reader.read(3) == b'012'
+    assert reader.seek(0, io.SEEK_END) == 10
+    assert reader.seek(-2, io.SEEK_END) == 8
+    assert reader.read() == b'89'
+    reader.seek(0)
+    assert reader.read() == b'0123456789'
+
+def test_cli_removes_queue_log_handler_on_exit():
+    handlers_before = list(logging.getLogger().handlers)
+    runner = CliRunner()
+    result = runner.invoke(main, ['--config-file', 'nonexistent.conf'])
+    assert result.exit_code != 0
+    assert logging.getLogger().handlers == handlers_before
+
+def test_hash_cache_accepts_bare_filename(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    hash_cache = HashCache('cache.sqlite', 'host')
+    hash_cache.put('a.txt', 10, 100, 'abcd')
+    assert hash_cache.get('a.txt', 10, 100)[0] == 'abcd'
+    hash_cache.close()
+    assert (tmp_path / 'cache.sqlite').exists()
+
+@mock.patch('sftp_to_s3_sync.cli.logger', create=True)
+def test_list_files_recursively_rejects_zero_workers(mock_logger):
+    with pytest.raises(ValueError, match="max_parallel_listings"):
+        list(list_files_recursively(mock.Mock(), max_workers=0))
+
+@mock.patch('sftp_to_s3_sync.cli.MD5ProcessPool')
+@mock.patch('sftp_to_s3_sync.cli.connect_sftp')
+@mock.patch('sftp_to_s3_sync.cli.connect_s3')
+def test_sync_null_md5_threshold_disables_md5_pool(mock_connect_s3, mock_connect_sftp, mock_md5_pool):
+    mock_connect_sftp.return_value = mock.MagicMock()
+
+    runner = CliRunner()
+    with runner.isolated_filesystem():
+        with open('config_mock.yaml', 'w') as f:
+            f.write("s3:\n  bucket: bucket\nparallel_md5_threshold: null\n")
+        result = runner.invoke(main, ['--config-file', 'config_mock.yaml'])
+
+    assert result.exit_code == 0, result.output
+    mock_md5_pool.assert_not_called()
+
+def test_needs_upload_matches_listed_etag_against_cached_md5(tmp_path):
+    s3_mock = mock.Mock()
+    md5 = hashlib.md5(b'0123456789').hexdigest()
+    hash_cache = HashCache(str(tmp_path / 'cache.sqlite'), 'host')
+    hash_cache.put('a.txt', 10, 100, md5)
+    file_obj = mock.Mock()
+
+    upload, digests = needs_upload(
+        s3_mock, 'bucket', 'key', file_obj, 100, 10, 100,
+        file_path='a.txt', hash_cache=hash_cache, remote_objects={'key': (md5, 10)}
+    )
+    assert not upload
+    assert digests[0] == md5
+    s3_mock.head_object.assert_not_called()
+    file_obj.read.assert_not_called()
+    hash_cache.close()
+
+@mock.patch('sftp_to_s3_sync.cli.connect_sftp')
+def test_sftp_connection_pool_closes_clients_when_a_connect_fails(mock_connect_sftp):
+    clients = [mock.Mock(name='client0'), mock.Mock(name='client2')]
+    mock_connect_sftp.side_effect = [clients[0], click.ClickException('refused'), clients[1]]
+
+    with pytest.raises(click.ClickException):
+        SFTPConnectionPool('host', 'user', 'pass', 22, size=3)
+    for client in clients:
+        client.close.assert_called_once()